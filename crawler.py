@@ -1,32 +1,35 @@
 import argparse
 import calendar
+from concurrent.futures import ThreadPoolExecutor, wait
+import functools
 import inspect
 import json
 import logging
 import os
 from pathlib import Path
+import queue
 import re
-import requests
+import httpx
 import signal
-import sys
+import threading
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 _base_url = 'https://api.github.com/'
 _pulls_url_template = _base_url + 'repos/{owner}/{repo}/pulls?state=all&sort=created&direction=asc&per_page={per_page}&page={page}'
 _issues_url_template = _base_url + 'repos/{owner}/{repo}/issues?state=all&sort=created&direction=asc&per_page={per_page}&page={page}'
 _pull_url_template = _base_url + 'repos/{owner}/{repo}/pulls/{pull_number}'
 _issue_url_template = _base_url + 'repos/{owner}/{repo}/issues/{issue_number}'
 
-_repo_path_template = os.path.join('{dst_dir}', '{owner}', '{repo}')
-_pulls_path_template = os.path.join('{dst_dir}', '{owner}', '{repo}', 'pulls-page-{page}.json')
-_pull_path_template = os.path.join('{dst_dir}', '{owner}', '{repo}', 'pull-{pull_number}.json')
-_issue_path_template = os.path.join('{dst_dir}', '{owner}', '{repo}', 'issue-{issue_number}.json')
-_diff_path_template = os.path.join('{dst_dir}', '{owner}', '{repo}', 'pull-{pull_number}.diff')
-
 _linked_issues_pattern_template = r'\b(?:close|closes|closed|fix|fixes|fixed|resolve|resolves|resolved)\s+(?:https://github\.com/{owner}/{repo}/issues/|{owner}/{repo}#|#)(\d+)\b'
 
 _last_page_pattern = re.compile(r'page=(\d+)>; rel="last"')
 
+@functools.lru_cache(maxsize=None)
 def _make_linked_issues_regex(owner, repo):
     owner = owner.replace('.', r'\.')
     repo = repo.replace('.', r'\.')
@@ -38,17 +41,42 @@ def _extract_linked_issue_numbers(pull_body, linked_issues_regex):
         return []
     return [int(n) for n in linked_issues_regex.findall(pull_body)]
 
-def _save_json(obj, path):
-    with open(path, 'w') as f:
-        json.dump(obj, f, indent=2, sort_keys=True)
+def _json_bytes(obj, pretty=False):
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS if pretty else 0
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2, sort_keys=True).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
 
-def _save_txt(txt, path):
+def _save_json(obj, path, pretty=False):
     with open(path, 'wb') as f:
-        f.write(txt)
+        f.write(_json_bytes(obj, pretty=pretty))
+
+def _read_json(path):
+    with open(path, 'rb') as f:
+        if orjson is not None:
+            return orjson.loads(f.read())
+        return json.load(f)
+
+def _parse_json_response(r):
+    if orjson is not None:
+        return orjson.loads(r.content)
+    return r.json()
+
+def _response_json(r):
+    # _try_to_get attaches the body it already parsed for the error check.
+    try:
+        return r.parsed_json
+    except AttributeError:
+        return _parse_json_response(r)
 
 def _iso_to_unix(iso):
-    utc_time = time.strptime(iso, '%Y-%m-%dT%H:%M:%SZ')
-    return calendar.timegm(utc_time)
+    # The format is always 'YYYY-MM-DDTHH:MM:SSZ'; parsing the fields directly
+    # is an order of magnitude faster than time.strptime.
+    return calendar.timegm((int(iso[0:4]), int(iso[5:7]), int(iso[8:10]),
+                            int(iso[11:13]), int(iso[14:16]), int(iso[17:19]),
+                            0, 0, 0))
 
 def _ensure_dir_exists(path):
     Path(path).mkdir(parents=True, exist_ok=True)
@@ -68,7 +96,8 @@ class Crawler(object):
     will be saved in DEST_DIR/owner/repo. The directories will be created if they
     do not already exist. The naming pattern for files is issue-N.json for issues,
     pull-N.json for pull requests, and pulls-page-N.json for pages of pull
-    requests. Any existing file will be overwritten. The GitHub API limits
+    requests. Pull, diff, and issue files that already exist on disk are
+    reused instead of fetched again, unless force_refresh is set. The GitHub API limits
     unauthenticated clients to 60 requests per hour. The rate limit is 5,000
     requests per hour for authenticated clients. For this reason, you should
     provide a GitHub OAuth token if you want to crawl a large repository. You can
@@ -82,6 +111,10 @@ class Crawler(object):
             terminating.
         request_retry_wait_secs (int): Seconds to wait before retrying a failed request.
         max_pull_number (int): Maximun number of pull requests to crawl.
+        max_concurrency (int): Maximum number of concurrent requests per page.
+        pretty_json (bool): Save indented, key-sorted JSON instead of compact.
+        force_refresh (bool): Re-download pulls, diffs, and issues that are
+            already on disk.
     """
 
     def __init__(self,
@@ -93,7 +126,10 @@ class Crawler(object):
                  request_retry_wait_secs=10,
                  max_issue_number=-1,
                  start_date="2000-01-01",
-                 end_date="2050-01-01"):
+                 end_date="2050-01-01",
+                 max_concurrency=16,
+                 pretty_json=False,
+                 force_refresh=False):
         """Initializes Crawler.
 
         The GitHub API limits unauthenticated clients to 60 requests per hour. The
@@ -111,12 +147,19 @@ class Crawler(object):
             max_request_tries (int): Number of times to try a request before
                 terminating.
             request_retry_wait_secs (int): Seconds to wait before retrying a failed request.
+            max_concurrency (int): Maximum number of concurrent requests per page.
+            pretty_json (bool): Save indented, key-sorted JSON instead of compact.
+            force_refresh (bool): Re-download pulls, diffs, and issues that are
+                already on disk.
         """
         self.dst_dir = dst_dir
         self.per_page = per_page
         self.save_pull_pages = save_pull_pages
         self.max_request_tries = max_request_tries
         self.request_retry_wait_secs = request_retry_wait_secs
+        self.max_concurrency = max_concurrency
+        self.pretty_json = pretty_json
+        self.force_refresh = force_refresh
         self.start_date = _iso_to_unix(start_date + "T00:00:00Z")
         self.end_date = _iso_to_unix(end_date + "T00:00:00Z")
         self._headers = {
@@ -124,13 +167,42 @@ class Crawler(object):
         }
         if token is not None:
             self._headers['Authorization'] = 'token ' + token
+        self._session = httpx.Client(
+            http2=True,
+            headers=self._headers,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=max(20, max_concurrency)))
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._rl_limit = 5000
+        self._rl_remaining = 5000
+        self._rl_reset = 0
+        self._rl_lock = threading.Lock()
         self._max_issue_number = max_issue_number
-        self._interrupted = False
-        def sigint_handler(signal, frame):
-            if self._interrupted:
+        self._etags = {}
+        self._etags_path = None
+        self._repo_dir = None
+        self._write_q = queue.Queue(maxsize=256)
+        self._write_thread = threading.Thread(target=self._drain_writes, daemon=True)
+        self._write_thread.start()
+
+    # Shared across instances so one SIGINT drains every in-flight crawl when
+    # repositories are crawled in parallel.
+    _interrupted = threading.Event()
+
+    @classmethod
+    def install_signal_handler(cls):
+        """Installs a SIGINT handler that finishes the current page of every
+        running crawl before exiting. A second interrupt forces an exit.
+
+        Should be called once, from the main thread.
+        """
+        def sigint_handler(signum, frame):
+            if cls._interrupted.is_set():
                 print('\nForced exit')
-                sys.exit(2)
-            self._interrupted = True
+                # sys.exit would still join the non-daemon pool threads and
+                # drain every in-flight page; end the process outright.
+                os._exit(2)
+            cls._interrupted.set()
             print('\nInterrupted, finishing current page\nPress interrupt key again to force exit')
         signal.signal(signal.SIGINT, sigint_handler)
 
@@ -152,7 +224,8 @@ class Crawler(object):
         will be saved in DEST_DIR/owner/repo. The directories will be created if they
         do not already exist. The naming pattern for files is issue-N.json for issues,
         pull-N.json for pull requests, and pulls-page-N.json for pages of pull
-        requests. Any existing file will be overwritten.
+        requests. Pull, diff, and issue files that already exist on disk are
+        reused instead of fetched again, unless force_refresh is set.
 
         Args:
             owner (str): The username of the repository owner, e.g., "octocat" for the
@@ -165,10 +238,37 @@ class Crawler(object):
             TooManyRequestFailures: A request failed max_request_tries times.
         """
 
+        repo_dir = os.path.join(self.dst_dir, owner, repo)
+        _ensure_dir_exists(repo_dir)
+        self._repo_dir = repo_dir
+        self._etags_path = os.path.join(repo_dir, 'etags.json')
+        try:
+            self._etags = _read_json(self._etags_path)
+        except (OSError, ValueError):
+            self._etags = {}
+        progress_path = os.path.join(repo_dir, 'progress.json')
+        try:
+            progress = _read_json(progress_path)
+        except (OSError, ValueError):
+            progress = None
+        list_issues = {}
+        skip_pulls = False
+        if progress is not None:
+            logging.info('Resuming from progress file: {}'.format(progress))
+            print('Resuming {} crawl from page {} ({}/{})'.format(progress['phase'], progress['page'], owner, repo))
+            list_issues = {n: True for n in progress.get('seen_issues', [])}
+            if progress['phase'] == 'pulls':
+                if start_page_pulls < 1:
+                    start_page_pulls = progress['page']
+            else:
+                skip_pulls = True
+                if start_page_issues < 1:
+                    start_page_issues = progress['page']
+
         pulls_url = _pulls_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page='{page}')
         issues_url = _issues_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page='{page}')
 
-        if start_page_pulls < 1:
+        if start_page_pulls < 1 and not skip_pulls:
             if self.start_date < _iso_to_unix("2015-01-01T00:00:00Z"):
                 logging.info('Starting date before 2015. Pulls starting at page 1.')
                 print('Starting date before 2015. Pulls starting at page 1.')
@@ -189,7 +289,7 @@ class Crawler(object):
             logging.info('Issues starting page found: {}'.format(start_page_issues))
             print('Issues starting page: {}'.format(start_page_issues))
 
-        if end_page_pulls < 1:
+        if end_page_pulls < 1 and not skip_pulls:
             if self.end_date > time.time():
                 logging.info('Ending date after current time. Pulls ending at page -1')
                 print('Ending date after current time. Pulls ending at page -1.')
@@ -213,52 +313,50 @@ class Crawler(object):
                 logging.info('Issues ending page found: {}'.format(end_page_issues))
                 print('Issues ending page: {}'.format(end_page_issues))
 
-        _ensure_dir_exists(_repo_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo))
         linked_issues_regex = _make_linked_issues_regex(owner, repo)
         page = start_page_pulls
         num_issues = 0
         num_pulls = 0
-        list_issues = {}
-        self._interrupted = False
         logging.info('Pulls crawl: starting {} {}/{}'.format(start_page_pulls, owner, repo))
         print('Pulls: Starting from page {} ({}/{})'.format(start_page_pulls, owner, repo))
-        while not self._interrupted and not (self._max_issue_number > 0 and num_issues >= self._max_issue_number) and not (end_page_pulls > 0 and page > end_page_pulls):
+        while not skip_pulls and not self._interrupted.is_set() and not (self._max_issue_number > 0 and num_issues >= self._max_issue_number) and not (end_page_pulls > 0 and page > end_page_pulls):
             pulls, ok = self._get_json(_pulls_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page=page))
             if not ok:
                 continue
             if self.save_pull_pages:
-                _save_json(pulls, _pulls_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, page=page))
-            for p in pulls:
-                if _iso_to_unix(p['created_at']) < self.start_date or _iso_to_unix(p['created_at']) > self.end_date:
-                    continue
-                linked_issue_numbers = _extract_linked_issue_numbers(p.get('body'), linked_issues_regex)
-                pull_number = p['number']
-                pull, ok = self._get_json(_pull_url_template.format(owner=owner, repo=repo, pull_number=pull_number))
-                if not ok:
-                    continue
-                pull['linked_issue_numbers'] = linked_issue_numbers
-                diff_url = pull['diff_url']
-                diff, ok = self._get(diff_url)
-                if not ok:
+                self._enqueue_write(pulls, os.path.join(repo_dir, f'pulls-page-{page}.json'))
+            # Filter and extract over the whole page up front, then submit.
+            candidates = [p for p in pulls
+                          if p.get('merged_at') is not None
+                          and self.start_date <= _iso_to_unix(p['created_at']) <= self.end_date]
+            linked_lists = [_extract_linked_issue_numbers(p.get('body'), linked_issues_regex) for p in candidates]
+            futures = [self._pool.submit(self._fetch_and_save_pull, owner, repo, p['number'], linked_issue_numbers)
+                       for p, linked_issue_numbers in zip(candidates, linked_lists)
+                       if linked_issue_numbers]
+            for i, future in enumerate(futures):
+                saved_issue_numbers = future.result()
+                if saved_issue_numbers is None:
                     continue
-                _save_txt(diff.content, _diff_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, pull_number=pull_number))
-                _save_json(pull, _pull_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, pull_number=pull_number))
-                for issue_number in linked_issue_numbers:
-                    issue, ok = self._get_json(_issue_url_template.format(owner=owner, repo=repo, issue_number=issue_number))
-                    if not ok:
-                        continue
-                    _save_json(issue, _issue_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, issue_number=issue_number))
+                for issue_number in saved_issue_numbers:
                     num_issues += 1
                     list_issues[issue_number] = True
                 num_pulls += 1
                 if self._max_issue_number > 0 and num_issues >= self._max_issue_number:
+                    for pending in futures[i+1:]:
+                        pending.cancel()
                     break
+            # After an early break some fetches may still be running and
+            # inserting ETags; let them settle before the index is serialized.
+            wait(futures)
+            self._write_q.join()
+            _save_json(self._etags, self._etags_path)
+            _save_json({'phase': 'pulls', 'page': page + 1, 'seen_issues': sorted(list_issues)}, progress_path)
             logging.info('Pulls crawl: finished {}, saved {} issues and {} pull requests ({}/{})'.format(page, num_issues, num_pulls, owner, repo))
             print('Pulls page {} finished, saved {} issues and {} pull requests ({}/{})'.format(page, num_issues, num_pulls, owner, repo))
             if len(pulls) < self.per_page or (self._max_issue_number > 0 and num_issues >= self._max_issue_number):
                 logging.info('Pulls crawl: finished all, {} issues {} pulls ({}/{})'.format(num_issues, num_pulls, owner, repo))
                 print('Pulls all pages finished, saved {} issues and {} pull requests ({}/{})'.format(num_issues, num_pulls, owner, repo))
-                if self._interrupted:
+                if self._interrupted.is_set():
                     return
                 break
             page += 1
@@ -267,95 +365,205 @@ class Crawler(object):
         num_issues = 0
         logging.info('Issues crawl: starting {} {}/{}'.format(start_page_issues, owner, repo))
         print('Issues: Starting from page {} ({}/{})'.format(start_page_issues, owner, repo))
-        while not self._interrupted and not (self._max_issue_number > 0 and num_issues >= self._max_issue_number) and not (end_page_issues > 0 and page > end_page_issues):
+        while not self._interrupted.is_set() and not (self._max_issue_number > 0 and num_issues >= self._max_issue_number) and not (end_page_issues > 0 and page > end_page_issues):
             issues, ok = self._get_json(_issues_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page=page))
             if not ok:
                 continue
             for i in issues:
                 issue_number = i['number']
-                if issue_number in list_issues or _iso_to_unix(i['created_at']) < self.start_date or _iso_to_unix(i['created_at']) > self.end_date:
+                created_at = _iso_to_unix(i['created_at'])
+                if issue_number in list_issues or created_at < self.start_date or created_at > self.end_date:
                     continue
-                issue, ok = self._get_json(_issue_url_template.format(owner=owner, repo=repo, issue_number=issue_number))
+                issue_path = os.path.join(repo_dir, f'issue-{issue_number}.json')
+                r, ok = self._get(_issue_url_template.format(owner=owner, repo=repo, issue_number=issue_number), cache_path=issue_path)
                 if not ok:
                     continue
-                _save_json(issue, _issue_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, issue_number=issue_number))
+                if r.status_code != 304:
+                    self._enqueue_write(_response_json(r), issue_path)
                 num_issues += 1
                 if self._max_issue_number > 0 and num_issues >= self._max_issue_number:
                     break
+            self._write_q.join()
+            _save_json(self._etags, self._etags_path)
+            _save_json({'phase': 'issues', 'page': page + 1, 'seen_issues': sorted(list_issues)}, progress_path)
             logging.info('Issues crawl: finished {}, saved {} issues ({}/{})'.format(page, num_issues, owner, repo))
             print('Issues page {} finished, saved {} issues ({}/{})'.format(page, num_issues, owner, repo))
             if len(issues) < self.per_page or (self._max_issue_number > 0 and num_issues >= self._max_issue_number):
                 logging.info('Issues crawl: finished all, {} issues ({}/{})'.format(num_issues, owner, repo))
                 print('Issues all pages finished, saved {} issues ({}/{})'.format(num_issues, owner, repo))
-                if self._interrupted:
+                if self._interrupted.is_set():
                     return
                 break
             page += 1
 
+        if not self._interrupted.is_set():
+            try:
+                os.remove(progress_path)
+            except OSError:
+                pass
+
+    def _fetch_and_save_pull(self, owner, repo, pull_number, linked_issue_numbers):
+        """Fetches and saves a pull request, its diff, and its linked issues.
+
+        Returns the list of linked issue numbers that were saved, or None if the
+        pull request or its diff could not be fetched.
+        """
+        repo_dir = self._repo_dir
+        pull_path = os.path.join(repo_dir, f'pull-{pull_number}.json')
+        diff_path = os.path.join(repo_dir, f'pull-{pull_number}.diff')
+        if self.force_refresh or not (os.path.exists(pull_path) and os.path.exists(diff_path)):
+            r, ok = self._get(_pull_url_template.format(owner=owner, repo=repo, pull_number=pull_number), cache_path=pull_path)
+            if not ok:
+                return None
+            if r.status_code == 304:
+                pull = _read_json(pull_path)
+            else:
+                pull = _response_json(r)
+            pull['linked_issue_numbers'] = linked_issue_numbers
+            diff_url = pull['diff_url']
+            if not self._get_stream(diff_url, diff_path):
+                return None
+            if r.status_code != 304:
+                self._enqueue_write(pull, pull_path)
+        saved_issue_numbers = []
+        for issue_number in linked_issue_numbers:
+            issue_path = os.path.join(repo_dir, f'issue-{issue_number}.json')
+            if not self.force_refresh and os.path.exists(issue_path):
+                saved_issue_numbers.append(issue_number)
+                continue
+            r, ok = self._get(_issue_url_template.format(owner=owner, repo=repo, issue_number=issue_number), cache_path=issue_path)
+            if not ok:
+                continue
+            if r.status_code != 304:
+                self._enqueue_write(_response_json(r), issue_path)
+            saved_issue_numbers.append(issue_number)
+        return saved_issue_numbers
+
+    def _enqueue_write(self, obj, path):
+        self._write_q.put((path, _json_bytes(obj, pretty=self.pretty_json)))
+
+    def _drain_writes(self):
+        while True:
+            path, data = self._write_q.get()
+            try:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            except Exception as e:
+                logging.error('Write: exception: {} {}'.format(path, e))
+            finally:
+                self._write_q.task_done()
+
     def _get_starting_page(self, url):
-        r, ok = self._get(url.format(page=1))
+        probe_url = url.replace('per_page={}'.format(self.per_page), 'per_page=1')
+        r, ok = self._get(probe_url.format(page=1))
         link = r.headers['Link']
-        last_page = int(_last_page_pattern.findall(link)[0])
-        start_page = self._find_start_page(url, 1, last_page)
-        return start_page
-
-    def _find_start_page(self, url, start, end):
-        mid = round((start + end)/2)        
-        print('querying at {} between {} and {}'.format(mid, start, end))
-        pulls, ok = self._get_json(url.format(page=mid))
-        first_date = _iso_to_unix(pulls[0]['created_at'])
-        last_date = _iso_to_unix(pulls[-1]['created_at'])
-
-        if start == end:
-            print('first: {}, last: {}, goal: {}'.format(first_date, last_date, self.start_date))
-            if self.start_date > last_date:
-                return mid + 1
-            return mid
-
-        if self.start_date < first_date:
-            return self._find_start_page(url, start, mid)
-        if self.start_date > last_date:
-            return self._find_start_page(url, mid, end)
-        return mid
+        total_items = int(_last_page_pattern.findall(link)[0])
+        last_page = (total_items + self.per_page - 1) // self.per_page
+        return self._find_start_page(probe_url, total_items, last_page)
+
+    def _find_start_page(self, probe_url, total_items, last_page):
+        # Iterative binary search for the first page whose last item is not
+        # older than start_date. Probes fetch a single item (per_page=1), so
+        # each step transfers one object instead of a whole page.
+        cache = {}
+        start = 1
+        end = last_page
+        while start < end:
+            mid = (start + end) // 2
+            print('querying at {} between {} and {}'.format(mid, start, end))
+            last_date = self._item_created_at(probe_url, min(mid * self.per_page, total_items), cache)
+            if last_date < self.start_date:
+                start = mid + 1
+            else:
+                end = mid
+        if self._item_created_at(probe_url, min(start * self.per_page, total_items), cache) < self.start_date:
+            return start + 1
+        return start
 
     def _get_ending_page(self, url):
-        r, ok = self._get(url.format(page=1))
+        probe_url = url.replace('per_page={}'.format(self.per_page), 'per_page=1')
+        r, ok = self._get(probe_url.format(page=1))
         link = r.headers['Link']
-        last_page = int(_last_page_pattern.findall(link)[0])
-        start_page = self._find_end_page(url, 1, last_page)
-        return start_page
-
-    def _find_end_page(self, url, start, end):
-        mid = round((start + end)/2)
-        print('querying at {} between {} and {}'.format(mid, start, end))
-        pulls, ok = self._get_json(url.format(page=mid))
-        first_date = _iso_to_unix(pulls[0]['created_at'])
-        last_date = _iso_to_unix(pulls[-1]['created_at'])
-
-        if start == end:
-            print('first: {}, last: {}, goal: {}'.format(first_date, last_date, self.start_date))
-            if self.end_date < first_date:
-                return mid - 1
-            return mid
-
-        if self.end_date < first_date:
-            return self._find_end_page(url, start, mid)
-        if self.end_date > last_date:
-            return self._find_end_page(url, mid, end)
-        return mid
+        total_items = int(_last_page_pattern.findall(link)[0])
+        last_page = (total_items + self.per_page - 1) // self.per_page
+        return self._find_end_page(probe_url, total_items, last_page)
+
+    def _find_end_page(self, probe_url, total_items, last_page):
+        # Iterative binary search for the last page whose first item is not
+        # newer than end_date.
+        cache = {}
+        start = 1
+        end = last_page
+        while start < end:
+            mid = (start + end + 1) // 2
+            print('querying at {} between {} and {}'.format(mid, start, end))
+            first_date = self._item_created_at(probe_url, (mid - 1) * self.per_page + 1, cache)
+            if first_date > self.end_date:
+                end = mid - 1
+            else:
+                start = mid
+        if self._item_created_at(probe_url, (start - 1) * self.per_page + 1, cache) > self.end_date:
+            return start - 1
+        return start
+
+    def _item_created_at(self, probe_url, index, cache):
+        if index not in cache:
+            items, ok = self._get_json(probe_url.format(page=index))
+            cache[index] = _iso_to_unix(items[0]['created_at'])
+        return cache[index]
 
     def _get_json(self, url):
         r, ok = self._get(url)
         if ok:
-            return r.json(), ok
+            return _response_json(r), ok
         else:
             return {}, ok
 
 
-    def _get(self, url):
+    def _get_stream(self, url, path):
+        """Downloads url into path in chunks, without buffering the whole body.
+
+        Returns True on success. A 304 answer leaves the existing file as is.
+        The body is consumed outside _try_to_get, so transport errors while
+        streaming get their own retry loop here.
+
+        Raises:
+            TooManyRequestFailures: The download failed max_request_tries times.
+        """
+        tries = 0
+        while True:
+            r, ok = self._get(url, cache_path=path, stream=True)
+            if not ok:
+                return False
+            try:
+                if r.status_code != 304:
+                    # Stream into a temp file and rename once complete, so an
+                    # interrupted download never leaves a truncated file that
+                    # a later run would skip as already saved.
+                    tmp_path = path + '.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in r.iter_bytes(1 << 16):
+                            f.write(chunk)
+                    os.replace(tmp_path, path)
+                r.close()
+                return True
+            except httpx.HTTPError as e:
+                logging.error('Stream: exception: {} {}'.format(url, e))
+                try:
+                    r.close()
+                except httpx.HTTPError:
+                    pass
+            tries += 1
+            if tries >= self.max_request_tries:
+                print('Request failed {} times, aborting'.format(tries))
+                raise TooManyRequestFailures('{} request failures for {}'.format(tries, url))
+            print('Request failed {} times, retrying in {} seconds'.format(tries, self.request_retry_wait_secs))
+            time.sleep(self.request_retry_wait_secs)
+
+    def _get(self, url, cache_path=None, stream=False):
         tries = 0
         while True:
-            r, ok = self._try_to_get(url)
+            r, ok = self._try_to_get(url, cache_path=cache_path, stream=stream)
             if r is not None:
                 return r, ok
             tries += 1
@@ -365,26 +573,90 @@ class Crawler(object):
             print('Request failed {} times, retrying in {} seconds'.format(tries, self.request_retry_wait_secs))
             time.sleep(self.request_retry_wait_secs)
 
-    def _try_to_get(self, url):
+    def _wait_for_rate_limit(self):
+        # Stall before the quota is exhausted instead of bursting into 403s:
+        # at high concurrency a reactive sleep lets every in-flight request
+        # fail first and burn a retry each.
+        with self._rl_lock:
+            remaining = self._rl_remaining
+            reset = self._rl_reset
+            limit = self._rl_limit
+        # Scale the safety margin with the quota the server reports: 50 for
+        # the authenticated 5,000/hr limit, 6 for the unauthenticated 60/hr.
+        if remaining >= min(50, limit // 10):
+            return
+        ratelimit_wait_secs = reset - int(time.time()) + 1
+        if ratelimit_wait_secs > 0:
+            logging.info('Get: waiting {} secs for rate limit reset'.format(ratelimit_wait_secs))
+            print('Rate limit nearly exhausted, waiting {} secs for reset'.format(ratelimit_wait_secs))
+            time.sleep(ratelimit_wait_secs)
+        with self._rl_lock:
+            if self._rl_reset == reset:
+                self._rl_remaining = self._rl_limit
+
+    def _update_rate_limit(self, headers):
         try:
-            r = requests.get(url, headers=self._headers)
-            if not r.ok:
+            remaining = int(headers['X-Ratelimit-Remaining'])
+            reset = int(headers['X-Ratelimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        try:
+            limit = int(headers['X-Ratelimit-Limit'])
+        except (KeyError, ValueError):
+            limit = None
+        with self._rl_lock:
+            self._rl_remaining = remaining
+            self._rl_reset = reset
+            if limit is not None:
+                self._rl_limit = limit
+
+    def _try_to_get(self, url, cache_path=None, stream=False):
+        headers = None
+        if cache_path is not None:
+            etag = self._etags.get(url)
+            if etag is not None and os.path.exists(cache_path):
+                headers = {'If-None-Match': etag}
+        self._wait_for_rate_limit()
+        try:
+            if stream:
+                r = self._session.send(self._session.build_request('GET', url, headers=headers), stream=True)
+            else:
+                r = self._session.get(url, headers=headers)
+            self._update_rate_limit(r.headers)
+            if r.is_error:
+                if stream:
+                    r.read()
                 logging.error('Get: not ok: {} {} {} {}'.format(url, r.status_code, r.headers, r.text))
                 if r.status_code == 404:
                     return {}, False
+                if 'Retry-After' in r.headers:
+                    retry_wait_secs = int(r.headers['Retry-After']) + 1
+                    logging.info('Get: waiting {} secs for Retry-After'.format(retry_wait_secs))
+                    print('Secondary rate limit reached, waiting {} secs'.format(retry_wait_secs))
+                    time.sleep(retry_wait_secs)
+                    return self._try_to_get(url, cache_path=cache_path, stream=stream)
                 if 'X-Ratelimit-Remaining' in r.headers and int(r.headers['X-Ratelimit-Remaining']) < 1 and 'X-Ratelimit-Reset' in r.headers:
                     ratelimit_wait_secs = int(r.headers['X-Ratelimit-Reset']) - int(time.time()) + 1
                     logging.info('Get: waiting {} secs for rate limit reset'.format(ratelimit_wait_secs))
                     print('Rate limit reached, waiting {} secs for reset'.format(ratelimit_wait_secs))
                     time.sleep(ratelimit_wait_secs)
-                    return self._try_to_get(url)
+                    return self._try_to_get(url, cache_path=cache_path, stream=stream)
                 return None, False
         except Exception as e:
             logging.error('Get: exception: {} {}'.format(url, e))
-            return None
-        if 'Content-Type' in r.headers and 'json' in r.headers['Content-Type'] and isinstance(r.json(), dict) and 'message' in r.json():
-            logging.error('Get: error: {} {}'.format(url, r.json()))
-            return None
+            return None, False
+        if r.status_code == 304:
+            return r, True
+        if not stream and 'json' in r.headers.get('Content-Type', ''):
+            body = _parse_json_response(r)
+            if isinstance(body, dict) and 'message' in body:
+                logging.error('Get: error: {} {}'.format(url, body))
+                return None, False
+            r.parsed_json = body
+        if cache_path is not None:
+            etag = r.headers.get('ETag')
+            if etag is not None:
+                self._etags[url] = etag
         return r, True
 
 def main():
@@ -400,7 +672,8 @@ def main():
                     'The directories will be created if they do not already exist. '
                     'The naming pattern for files is issue-N.json for issues, pull-N.json for pull requests, '
                     'and pulls-page-N.json for pages of pull requests. '
-                    'Any existing file will be overwritten. '
+                    'Pull, diff, and issue files that already exist on disk are reused instead of fetched again, '
+                    'unless --force-refresh is passed. '
                     'The GitHub API limits unauthenticated clients to 60 requests per hour. '
                     'The rate limit is 5,000 requests per hour for authenticated clients. '
                     'For this reason, you should provide a GitHub OAuth token if you want to crawl a large repository. '
@@ -421,6 +694,12 @@ def main():
         help='pull requests per page, between 1 and 100')
     parser.add_argument('-a', '--save-pull-pages', action='store_true',
         help='save the pages of pull requests')
+    parser.add_argument('-c', '--max-concurrency', type=int, default=init_params['max_concurrency'].default,
+        help='maximum number of concurrent requests per page')
+    parser.add_argument('--pretty', action='store_true',
+        help='save indented, key-sorted JSON instead of compact JSON')
+    parser.add_argument('--force-refresh', action='store_true',
+        help='re-download pulls, diffs, and issues that are already on disk')
     parser.add_argument('-m', '--max-request-tries', type=int, default=init_params['max_request_tries'].default,
         help='number of times to try a request before terminating')
     parser.add_argument('-r', '--request-retry-wait-secs', type=int, default=init_params['request_retry_wait_secs'].default,
@@ -449,19 +728,24 @@ def main():
                             datefmt='%Y-%m-%d %H:%M',
                             level=logging.DEBUG)
 
-    crawler = Crawler(token=args.token,
-                      dst_dir=args.dst_dir,
-                      per_page=args.per_page,
-                      save_pull_pages=args.save_pull_pages,
-                      max_request_tries=args.max_request_tries,
-                      request_retry_wait_secs=args.request_retry_wait_secs,
-                      max_issue_number=args.max_issue_number,
-                      start_date=args.start_date,
-                      end_date=args.end_date)
-    for r in args.repos:
+    Crawler.install_signal_handler()
+
+    def crawl_repo(r):
         n = r.find('/')
         owner = r[:n]
         repo = r[n+1:]
+        crawler = Crawler(token=args.token,
+                          dst_dir=args.dst_dir,
+                          per_page=args.per_page,
+                          save_pull_pages=args.save_pull_pages,
+                          max_request_tries=args.max_request_tries,
+                          request_retry_wait_secs=args.request_retry_wait_secs,
+                          max_issue_number=args.max_issue_number,
+                          start_date=args.start_date,
+                          end_date=args.end_date,
+                          max_concurrency=args.max_concurrency,
+                          pretty_json=args.pretty,
+                          force_refresh=args.force_refresh)
         try:
             crawler.crawl(owner,
                           repo,
@@ -473,5 +757,9 @@ def main():
             logging.error('Main: exception: {}/{} {}'.format(owner, repo, e))
             print('Terminated with error: {} ({}/{})'.format(e, owner, repo))
 
+    with ThreadPoolExecutor(max_workers=len(args.repos)) as pool:
+        for r in args.repos:
+            pool.submit(crawl_repo, r)
+
 if __name__ == '__main__':
     main()
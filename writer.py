@@ -1,21 +1,28 @@
 import argparse
+from array import array
 import calendar
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import csv
+import functools
 import inspect
 import json
+import mmap
+import multiprocessing
 import os
-import re
-import time
 from tqdm import tqdm
 
-_owner_path_template = os.path.join('{src_dir}', '{owner}')
-_repo_path_template = os.path.join('{src_dir}', '{owner}', '{repo}')
-_pull_path_template = os.path.join('{src_dir}', '{owner}', '{repo}', 'pull-{pull_number}.json')
-_diff_path_template = os.path.join('{src_dir}', '{owner}', '{repo}', 'pull-{pull_number}.diff')
-_issue_path_template = os.path.join('{src_dir}', '{owner}', '{repo}', 'issue-{issue_number}.json')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Serialized rows are joined and written in batches of this many rows.
+_write_batch_rows = 4096
+
+# Number of JSON file reads kept in flight ahead of the parser.
+_prefetch_depth = 8
 
-_diff_file_pattern = re.compile(r'^diff --git a\/(?:.*?) b\/(.*?)\n$')
-_diff_file_anchor_pattern = re.compile(r'(?:---|\+\+\+) \S*?\/(.*?)$')
 
 _sections = [
     'build/',
@@ -28,6 +35,12 @@ _sections = [
     'test/',
     'other ']
 
+# Every section prefix except the 'other ' catch-all is a single top-level
+# directory, so a filename maps to its section with one dict lookup on the
+# part before the first '/'.
+_section_index = {s[:-1]: i for i, s in enumerate(_sections[:-1])}
+_other_section = len(_sections) - 1
+
 _section_attributes = [
     'changed_files',
     'additions',
@@ -153,126 +166,245 @@ def write_dataset(src_dir,
     if probs_file:
         probs = _read_probs(probs_file)
 
-    with open(dst_file, 'w', newline='') as dataset_file:
-        dataset = csv.writer(dataset_file)
-        dataset.writerow(_dataset_header if not probs else _dataset_header + [f"pull_topic::{p.replace(' ', '_')}" for p in probs[0][1:]])
+    with open(dst_file, 'w', newline='', buffering=1 << 20) as dataset_file:
+        header = _dataset_header if not probs else _dataset_header + [f"pull_topic::{p.replace(' ', '_')}" for p in probs[0][1:]]
+        dataset_file.write(','.join(map(_csv_escape, header)) + '\r\n')
         owner_repo_pairs = _sorted_owner_repo_pairs(src_dir)
         num_repos = len(owner_repo_pairs)
-        for i, (owner, repo) in enumerate(owner_repo_pairs):
-            repo_full_name = '{}/{}'.format(owner, repo)
-            repo_full_names.append(repo_full_name)
-            repo_num_rows.append(0)
-            issue_list = {}
-            print('{} ({:,}/{:,})'.format(repo_full_name, i + 1, num_repos))
-            for j, pull_number in enumerate(tqdm(_sorted_pull_numbers(src_dir, owner, repo))):
-                pull = _read_json(_pull_path_template.format(src_dir=src_dir, owner=owner, repo=repo, pull_number=pull_number))
-                if _iso_to_unix(pull['created_at']) < start_date or _iso_to_unix(pull['created_at']) > end_date:
-                    continue
-                pull['linked_issue_numbers'].sort()
-
-                diff = None
-                try:
-                    diff = _read_diff(_diff_path_template.format(src_dir=src_dir, owner=owner, repo=repo, pull_number=pull_number))
-                except:
-                    diff = ""
-                _get_section_changes(pull, diff)
-                
-                for a in _section_attributes:
-                    if sum([pull['section_data'][i][a] for i in range(len(_sections))]) != pull[a]:
-                        print(a)
-                        print([pull['section_data'][i][a] for i in range(len(_sections))])
-                        print(sum([pull['section_data'][i][a] for i in range(len(_sections))]))
-                        print(pull[a])
-                        print(pull_number)
-                        pull[a] = sum([pull['section_data'][i][a] for i in range(len(_sections))])
-
-                if probs:
-                    pull['topics'] = probs[j + 1][1:]
-
-                for issue_number in pull['linked_issue_numbers']:
-                    issue = None
-                    try:
-                        issue = _read_json(_issue_path_template.format(src_dir=src_dir, owner=owner, repo=repo, issue_number=issue_number))
-                    except:
-                        continue
-                    if _iso_to_unix(issue['created_at']) < start_date or _iso_to_unix(issue['created_at']) > end_date:
-                        continue
-                    issue_list[issue_number] = True
-                    dataset.writerow(_dataset_row(issue, pull=pull, probs=len(probs[0]) - 1 if probs else 0))
-                    repo_num_rows[i] += 1
-                    total_num_rows += 1
-                    if total_num_rows == limit_rows:
-                        print('Limit of {:,} rows reached'.format(limit_rows))
-                        print_results()
-                        return
-                    
-            for issue_number in tqdm(_sorted_issue_numbers(src_dir, owner, repo)):
-                issue = _read_json(_issue_path_template.format(src_dir=src_dir, owner=owner, repo=repo, issue_number=issue_number))
-                if issue_number in issue_list or _iso_to_unix(issue['created_at']) < start_date or _iso_to_unix(issue['created_at']) > end_date:
-                    continue
-                dataset.writerow(_dataset_row(issue, probs=len(probs[0]) - 1 if probs else 0))
-                repo_num_rows[i] += 1
-                total_num_rows += 1
-                if total_num_rows == limit_rows:
+        process_repo = functools.partial(_process_repo, src_dir, start_date=start_date, end_date=end_date, probs=probs)
+        # Repos are processed one per worker; results come back in the sorted
+        # submission order, so the main process only has to write each batch.
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context('fork')) as executor:
+            batches = executor.map(process_repo,
+                                   [owner for owner, repo in owner_repo_pairs],
+                                   [repo for owner, repo in owner_repo_pairs],
+                                   chunksize=1)
+            for i, ((owner, repo), rows) in enumerate(zip(owner_repo_pairs, batches)):
+                repo_full_name = '{}/{}'.format(owner, repo)
+                repo_full_names.append(repo_full_name)
+                repo_num_rows.append(0)
+                print('{} ({:,}/{:,})'.format(repo_full_name, i + 1, num_repos))
+                if limit_rows > 0 and total_num_rows + len(rows) > limit_rows:
+                    rows = rows[:limit_rows - total_num_rows]
+                for start in range(0, len(rows), _write_batch_rows):
+                    dataset_file.write(''.join(rows[start:start + _write_batch_rows]))
+                repo_num_rows[i] += len(rows)
+                total_num_rows += len(rows)
+                if limit_rows > 0 and total_num_rows == limit_rows:
                     print('Limit of {:,} rows reached'.format(limit_rows))
                     print_results()
+                    # Leaving the with block would wait for every repo still
+                    # queued to be fully processed; drop them instead.
+                    executor.shutdown(wait=False, cancel_futures=True)
                     return
 
     print('Finished')
     print_results()
 
+def _process_repo(src_dir, owner, repo, start_date, end_date, probs):
+    """Reads the pulls and issues of one repository and returns their dataset
+    rows as serialized CSV lines, in pull number then issue number order.
+
+    Runs in a worker process, so everything it needs comes in as arguments and
+    everything it produces goes out through the return value.
+    """
+    rows = []
+    def serialize_row(row):
+        return ','.join(map(_csv_escape, row)) + '\r\n'
+
+    # The topic columns are known up front: issue-only rows always get a block
+    # of zeros and pull rows their own probabilities, so the suffixes are
+    # bound once here instead of being rebuilt and re-checked per row.
+    issue_only_topics = [0] * (len(probs[0]) - 1) if probs else []
+
+    # Issues that made it into a pull row, kept parsed so that issues linked
+    # by several pulls are read once and the unlinked pass can skip them
+    # without touching their files again.
+    issue_cache = {}
+    repo_dir = os.path.join(src_dir, owner, repo)
+    pull_numbers, issue_numbers = _sorted_pull_and_issue_numbers(repo_dir)
+    # File reads go through a small thread pool so the next few JSON files are
+    # already in memory while the current one is parsed; reads stay bounded by
+    # _prefetch_depth and are consumed strictly in order.
+    with ThreadPoolExecutor(max_workers=_prefetch_depth) as io_pool:
+        pull_reads = deque()
+        next_pull = 0
+        for j, pull_number in enumerate(tqdm(pull_numbers)):
+            while next_pull < len(pull_numbers) and len(pull_reads) < _prefetch_depth:
+                pull_reads.append(io_pool.submit(
+                    _read_bytes, os.path.join(repo_dir, f'pull-{pull_numbers[next_pull]}.json')))
+                next_pull += 1
+            pull = _loads_json(pull_reads.popleft().result())
+            created_unix = _iso_to_unix(pull['created_at'])
+            if created_unix < start_date or created_unix > end_date:
+                continue
+            pull['_created_unix'] = created_unix
+            pull['linked_issue_numbers'].sort()
+
+            try:
+                with open(os.path.join(repo_dir, f'pull-{pull_number}.diff'), 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as diff:
+                    _get_section_changes(pull, diff)
+            except (OSError, ValueError):
+                # Missing diff, or an empty one, which mmap refuses to map.
+                _get_section_changes(pull, b'')
+
+            for a in _section_attributes:
+                total = pull['_section_totals'][a]
+                if total != pull[a]:
+                    print(a)
+                    print(list(pull['section_data'][a]))
+                    print(total)
+                    print(pull[a])
+                    print(pull_number)
+                    pull[a] = total
+
+            topic_suffix = probs[j + 1][1:] if probs else []
+
+            linked_reads = [(issue_number, None if issue_number in issue_cache else io_pool.submit(
+                                 _read_bytes, os.path.join(repo_dir, f'issue-{issue_number}.json')))
+                            for issue_number in pull['linked_issue_numbers']]
+            for issue_number, read in linked_reads:
+                if read is None:
+                    issue = issue_cache[issue_number]
+                else:
+                    try:
+                        issue = _loads_json(read.result())
+                    except (OSError, ValueError):
+                        continue
+                    created_unix = _iso_to_unix(issue['created_at'])
+                    if created_unix < start_date or created_unix > end_date:
+                        continue
+                    issue['_created_unix'] = created_unix
+                    issue_cache[issue_number] = issue
+                rows.append(serialize_row(_dataset_row_with_pull(issue, pull, topic_suffix)))
+
+        unlinked_issue_numbers = [n for n in issue_numbers if n not in issue_cache]
+        issue_reads = deque()
+        next_issue = 0
+        for issue_number in tqdm(unlinked_issue_numbers):
+            while next_issue < len(unlinked_issue_numbers) and len(issue_reads) < _prefetch_depth:
+                issue_reads.append(io_pool.submit(
+                    _read_bytes, os.path.join(repo_dir, f'issue-{unlinked_issue_numbers[next_issue]}.json')))
+                next_issue += 1
+            issue = _loads_json(issue_reads.popleft().result())
+            created_unix = _iso_to_unix(issue['created_at'])
+            if created_unix < start_date or created_unix > end_date:
+                continue
+            issue['_created_unix'] = created_unix
+            rows.append(serialize_row(_dataset_row_issue_only(issue, issue_only_topics)))
+
+    return rows
+
 def _get_section_changes(pull, diff):
-    pull['section_data'] = [{a: 0 for a in _section_attributes} for s in _sections]
-    current_section = len(_sections) - 1
+    # One flat integer array per attribute, indexed by section, instead of a
+    # dict per section: each increment is then a single array store.
+    section_data = {a: array('i', [0] * len(_sections)) for a in _section_attributes}
+    changed_files = section_data['changed_files']
+    additions = section_data['additions']
+    deletions = section_data['deletions']
+    current_section = _other_section
     current_filename = ''
-    for line in diff:
-        file_match = _diff_file_pattern.match(line)
-        if file_match:
-            filename = file_match.group(1)
+    # Instead of a Python-level loop over every line, jump from one
+    # 'diff --git' header to the next and let bytes.count tally the '+'/'-'
+    # lines of the whole segment in C. The '+++'/'---' anchor lines are also
+    # counted by the two-byte patterns, so their four-byte counts are
+    # subtracted again. Only filenames are ever decoded.
+    # diff is any buffer with find() and slicing — a memory-mapped file in the
+    # normal case, so the file is never read into Python wholesale; only one
+    # segment at a time is materialized for counting.
+    size = len(diff)
+    if diff[:11] == b'diff --git ':
+        pos = 0
+    else:
+        pos = diff.find(b'\ndiff --git ')
+        if pos != -1:
+            pos += 1
+    # Anything before the first header belongs to the catch-all section, with
+    # a first line that has no preceding '\n' for the patterns to anchor on.
+    preamble_end = pos if pos != -1 else size
+    if preamble_end:
+        preamble = diff[:preamble_end]
+        additions[current_section] += preamble.count(b'\n+') - preamble.count(b'\n+++')
+        deletions[current_section] += preamble.count(b'\n-') - preamble.count(b'\n---')
+        first_line = preamble[:3]
+        if first_line[:1] == b'+' and first_line != b'+++':
+            additions[current_section] += 1
+        elif first_line[:1] == b'-' and first_line != b'---':
+            deletions[current_section] += 1
+    while pos != -1:
+        eol = diff.find(b'\n', pos)
+        if eol == -1:
+            eol = size
+        next_header = diff.find(b'\ndiff --git ', eol)
+        segment_end = size if next_header == -1 else next_header
+        parts = diff[pos:eol].split(b' b/', 1)
+        if len(parts) == 2:
+            filename = parts[1].decode('utf-8', errors='replace')
             if filename != current_filename:
-                current_section = next((i for (i, s) in enumerate(_sections) if filename.startswith(s)), len(_sections) - 1)
-                pull['section_data'][current_section]['changed_files'] += 1
+                top, sep, _ = filename.partition('/')
+                current_section = _section_index.get(top, _other_section) if sep else _other_section
+                changed_files[current_section] += 1
                 current_filename = filename
-            continue
-
-        if line.startswith('+') and not _diff_file_anchor_pattern.match(line):
-            pull['section_data'][current_section]['additions'] += 1
-            continue
-        if line.startswith('-') and not _diff_file_anchor_pattern.match(line):
-            pull['section_data'][current_section]['deletions'] += 1
-            continue
+        segment = diff[eol:segment_end]
+        additions[current_section] += segment.count(b'\n+') - segment.count(b'\n+++')
+        deletions[current_section] += segment.count(b'\n-') - segment.count(b'\n---')
+        pos = -1 if next_header == -1 else next_header + 1
+    pull['section_data'] = section_data
+    pull['_section_totals'] = {a: sum(counts) for a, counts in section_data.items()}
 
 def _sorted_owner_repo_pairs(src_dir):
     pairs = [] # [(owner1,repo1), (owner2,repo2)]
-    owners = os.listdir(src_dir)
-    owners.sort()
-    for owner in owners:
-        repos = os.listdir(_owner_path_template.format(src_dir=src_dir, owner=owner))
-        repos.sort()
-        for repo in repos:
-            pairs.append((owner, repo))
+    with os.scandir(src_dir) as owners:
+        for owner in owners:
+            if not owner.is_dir(follow_symlinks=False):
+                continue
+            with os.scandir(owner.path) as repos:
+                for repo in repos:
+                    if repo.is_dir(follow_symlinks=False):
+                        pairs.append((owner.name, repo.name))
+    pairs.sort()
     return pairs
 
-def _sorted_pull_numbers(src_dir, owner, repo):
-    filenames = os.listdir(_repo_path_template.format(src_dir=src_dir, owner=owner, repo=repo))
-    pull_numbers = [int(f[5:-5]) for f in filenames if f.startswith('pull-') and f.endswith('.json')]
+def _sorted_pull_and_issue_numbers(repo_dir):
+    pull_numbers = []
+    issue_numbers = []
+    with os.scandir(repo_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if not name.endswith('.json'):
+                continue
+            if name.startswith('pull-'):
+                pull_numbers.append(int(name[5:-5]))
+            elif name.startswith('issue-'):
+                issue_numbers.append(int(name[6:-5]))
     pull_numbers.sort()
-    return pull_numbers
-
-def _sorted_issue_numbers(src_dir, owner, repo):
-    filenames = os.listdir(_repo_path_template.format(src_dir=src_dir, owner=owner, repo=repo))
-    issue_numbers = [int(f[6:-5]) for f in filenames if f.startswith('issue-') and f.endswith('.json')]
     issue_numbers.sort()
-    return issue_numbers
-
-def _read_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
-    
-def _read_diff(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        return f.readlines()
-    
+    return pull_numbers, issue_numbers
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _loads_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _csv_escape(value):
+    """Formats one CSV field, quoting only when the value needs it.
+
+    Produces the same output as csv.writer with QUOTE_MINIMAL; quoting is
+    rare here (commas and quotes show up in titles and label lists)."""
+    if value is None:
+        return ''
+    s = value if isinstance(value, str) else str(value)
+    if '"' in s:
+        return '"' + s.replace('"', '""') + '"'
+    if ',' in s or '\n' in s or '\r' in s:
+        return '"' + s + '"'
+    return s
+
 def _read_probs(path):
     file = []
     with open(path, 'r', newline='') as f:
@@ -281,45 +413,68 @@ def _read_probs(path):
             file.append(row)
     return file
 
-def _dataset_row(issue, pull=None, probs=0):
-    issue_label_ids = ','.join(str(l['name']) for l in issue['labels'])
-    pull_label_ids = ','.join(str(l['name']) for l in pull['labels']) if pull else ''
-    section_row_data = [(pull['section_data'][i][a]) if pull else '' for a in _section_attributes for i in range(len(_sections))]
-    topic_row_data = pull['topics'] if pull else [0 for _ in range(probs)]
+# The pull-derived columns of a row without a pull never change, so they are
+# built once: empty values except the 'nopull' milestone marker, plus empty
+# section columns.
+_no_pull_row_data = [''] * 11 + ['nopull'] + [''] * 7 + [''] * (len(_section_attributes) * len(_sections))
+
+def _dataset_row_with_pull(issue, pull, topic_suffix):
+    issue_label_ids = ','.join(l['name'] for l in issue['labels'])
+    pull_label_ids = ','.join(l['name'] for l in pull['labels'])
+    section_row_data = []
+    for a in _section_attributes:
+        section_row_data += pull['section_data'][a].tolist()
     return [
         issue['number'],
         issue['title'],
-        _iso_to_unix(issue['created_at']),
+        issue['_created_unix'],
         _iso_to_unix(issue['closed_at']) if issue['closed_at'] else '',
         issue['user']['id'],
         _author_association_value[issue['author_association']],
         issue_label_ids,
         issue['state'],
         issue['state_reason'],
-        pull['number'] if pull else '',
-        _iso_to_unix(pull['created_at']) if pull else '',
-        _iso_to_unix(pull['updated_at']) if pull and pull['updated_at'] else '',
-        _iso_to_unix(pull['merged_at']) if pull and pull['merged_at'] else '',
-        pull['comments'] if pull else '',
-        pull['review_comments'] if pull else '',
-        pull['commits'] if pull else '',
-        pull['additions'] if pull else '',
-        pull['deletions'] if pull else '',
-        pull['changed_files'] if pull else '',
+        pull['number'],
+        pull['_created_unix'],
+        _iso_to_unix(pull['updated_at']) if pull['updated_at'] else '',
+        _iso_to_unix(pull['merged_at']) if pull['merged_at'] else '',
+        pull['comments'],
+        pull['review_comments'],
+        pull['commits'],
+        pull['additions'],
+        pull['deletions'],
+        pull['changed_files'],
         pull_label_ids,
-        (pull['milestone']['title'] if pull['milestone'] else 'none') if pull else 'nopull',
-        pull['state'] if pull else '',
-        (1 if pull['locked'] else 0) if pull else '',
-        (1 if pull['draft'] else 0) if pull else '',
-        (1 if pull['merged'] else 0) if pull else '',
-        (1 if pull['mergeable'] else 0) if pull else '',
-        pull['mergeable_state'] if pull else '',
-        (1 if pull['rebaseable'] else 0) if pull else '',
-    ] + section_row_data + topic_row_data
+        pull['milestone']['title'] if pull['milestone'] else 'none',
+        pull['state'],
+        1 if pull['locked'] else 0,
+        1 if pull['draft'] else 0,
+        1 if pull['merged'] else 0,
+        1 if pull['mergeable'] else 0,
+        pull['mergeable_state'],
+        1 if pull['rebaseable'] else 0,
+    ] + section_row_data + topic_suffix
+
+def _dataset_row_issue_only(issue, topic_suffix):
+    issue_label_ids = ','.join(l['name'] for l in issue['labels'])
+    return [
+        issue['number'],
+        issue['title'],
+        issue['_created_unix'],
+        _iso_to_unix(issue['closed_at']) if issue['closed_at'] else '',
+        issue['user']['id'],
+        _author_association_value[issue['author_association']],
+        issue_label_ids,
+        issue['state'],
+        issue['state_reason'],
+    ] + _no_pull_row_data + topic_suffix
 
 def _iso_to_unix(iso):
-    utc_time = time.strptime(iso, '%Y-%m-%dT%H:%M:%SZ')
-    return calendar.timegm(utc_time)
+    # The format is always 'YYYY-MM-DDTHH:MM:SSZ'; parsing the fields directly
+    # is an order of magnitude faster than time.strptime.
+    return calendar.timegm((int(iso[0:4]), int(iso[5:7]), int(iso[8:10]),
+                            int(iso[11:13]), int(iso[14:16]), int(iso[17:19]),
+                            0, 0, 0))
 
 def main():
     crawl_params = inspect.signature(write_dataset).parameters